@@ -1,4 +1,6 @@
+import time
 import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from passlib.context import CryptContext
@@ -15,11 +17,18 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 class AuthHandler():
     security = HTTPBearer()
     secret = 'SECRET'
+    # A token's claims are immutable, so memoize successful decodes for a
+    # short window; repeat requests with the same token skip the HMAC
+    # verification and JSON parsing entirely
+    payload_cache = TTLCache(maxsize=50_000, ttl=30)
 
-    def encode_token(self, user_id):
+    def encode_token(self, user_id, version=0):
         payload = {
             'exp': datetime.utcnow() + timedelta(days=0, minutes=5),
             'iat': datetime.utcnow(),
+            # The user's jwt_version at issue time; bumping the counter
+            # in the database revokes every token carrying an older value
+            'v': version,
             'sub': user_id
         }
         return jwt.encode(
@@ -28,14 +37,26 @@ class AuthHandler():
             algorithm='HS256'
         )
 
-    def decode_token(self, token):
+    def decode_payload(self, token):
+        payload = self.payload_cache.get(token)
+        if payload is not None:
+            # The cache window may outlive the token, so re-check expiry;
+            # exp is epoch seconds, so compare against time.time() (naive
+            # utcnow().timestamp() would reinterpret UTC as local time)
+            if time.time() >= payload['exp']:
+                raise HTTPException(status_code=401, detail='Signature has expired')
+            return payload
         try:
             payload = jwt.decode(token, self.secret, algorithms=['HS256'])
-            return payload['sub']
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail='Signature has expired')
         except jwt.InvalidTokenError as e:
             raise HTTPException(status_code=401, detail='Invalid token')
+        self.payload_cache[token] = payload
+        return payload
+
+    def decode_token(self, token):
+        return self.decode_payload(token)['sub']
 
     def auth_wrapper(self, auth: HTTPAuthorizationCredentials = Security(security)):
         return self.decode_token(auth.credentials)
\ No newline at end of file
@@ -0,0 +1,12 @@
+-- Covering indexes for the hot single-column filters in main.py.
+-- Run once against the sakila database, e.g.:
+--   mysql -u your_user -p sakila < migrations/001_add_covering_indexes.sql
+
+-- /films/category/{id}: serves the category -> film_id join (and the
+-- keyset ORDER BY film_id) straight from the index.
+CREATE INDEX ix_film_category_cover ON film_category (category_id, film_id);
+
+-- /customers/active/{store_id}: includes every selected column, so the
+-- query is answered from the index without touching the customer rows.
+CREATE INDEX ix_customer_store_active ON customer
+    (store_id, active, customer_id, first_name, last_name, email, address_id);
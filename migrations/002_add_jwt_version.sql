@@ -0,0 +1,4 @@
+-- Per-user token version for revocation: every issued JWT embeds the
+-- customer's current jwt_version, and revoking bumps the counter so all
+-- outstanding tokens for that user stop validating.
+ALTER TABLE customer ADD COLUMN jwt_version INT NOT NULL DEFAULT 0;